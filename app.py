@@ -1,15 +1,20 @@
 import eventlet
 eventlet.monkey_patch()
+from eventlet.hubs import trampoline
 
 import socket
+import struct
+import math
 import json
+import orjson
 import time
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO
 import threading
 import os
 import numpy as np
 from scipy.optimize import minimize
+from numba import njit
 import logging
 from datetime import datetime, timedelta
 
@@ -53,10 +58,14 @@ latest_data = {}
 # Structure: { "tag_id": [ (timestamp, [x, y, z]), ... ], ... }
 tag_history = {}
 
-# `anchor_positions` contient les coordonnées 3D de chaque ancre en MÈTRES.
+# Géométrie des ancres en MÈTRES, stockée sous forme de tableaux empilés (une ligne par ancre)
+# pour que le calcul des positions se limite à une sélection d'indices et des opérations vectorisées.
 # Les coordonnées sont chargées depuis `config.json` au démarrage.
-# Structure: { "A0": [x, y, z], "A1": [x, y, z], ... }
-anchor_positions = {}
+# `ANCHOR_IDS`: ("A0", "A1", ...), `ANCHOR_XYZ`: tableau (N, 3), `ANCHOR_SQNORM`: |a_i|², tableau (N,)
+ANCHOR_IDS = ()
+ANCHOR_XYZ = np.empty((0, 3), dtype=np.float64)
+ANCHOR_SQNORM = np.empty(0, dtype=np.float64)
+ANCHOR_ID_TO_IDX = {}
 
 # `screen_config` stocke la géométrie de l'écran de projection en MÈTRES.
 # Ces données sont soit calculées par le processus de calibration, soit définies manuellement.
@@ -69,16 +78,63 @@ calibration_data = []
 
 # --- System Configuration ---
 UDP_PORT = 16061
+# Kernel receive buffer of the UDP socket, large enough to queue bursts from many trackers instead of dropping them.
+UDP_RCVBUF_BYTES = 4 * 1024 * 1024
+# Maximum number of datagrams drained from the socket in one go, so other tasks still get to run under a flood.
+UDP_MAX_BATCH = 256
+# Compact binary datagram, accepted alongside the JSON one: tag number (uint8, tag "T<n>") followed by
+# the distances in meters (float32, little-endian) to BINARY_PACKET_ANCHOR_IDS, 17 bytes in total.
+# A negative or non-finite (NaN, infinite) distance means the anchor is out of range. No valid JSON message is that short.
+BINARY_PACKET = struct.Struct('<B4f')
+BINARY_PACKET_ANCHOR_IDS = ('A0', 'A1', 'A2', 'A3')
 # Seconds before a tracker is considered disconnected if no data is received.
 TRACKER_TIMEOUT_S = 10.0
+# Above this condition number of the normal equations, the closed-form trilateration
+# is considered unreliable (e.g. coplanar anchors) and the nonlinear solver is used instead.
+LINEAR_SOLVER_MAX_COND = 1e8
+# Half-size in meters of the search box of the nonlinear solvers (a 20x20x20 meter box around the origin).
+SOLVER_BOUND_M = 10.0
+# Rate (Hz) at which the pending tracker distances are solved and broadcast to the web clients,
+# whatever the packet rate.
+UPDATE_BROADCAST_HZ = 30.0
 
 # --- Flask & SocketIO Setup ---
+class OrjsonCodec:
+    """
+    JSON module handed to Flask-SocketIO so that packets are encoded/decoded with orjson.
+    Only the `dumps`/`loads` interface is needed; formatting options such as `separators`
+    are ignored since orjson always produces compact output.
+    """
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
 app.config['SECRET_KEY'] = 'a_very_secret_key_for_passive_listening!'
-socketio = SocketIO(app, async_mode='eventlet')
+socketio = SocketIO(app, async_mode='eventlet', json=OrjsonCodec)
 
 # --- Data Storage ---
+# tag_data_store and tag_json_cache are copy-on-write: they (and their entries) are never
+# modified once published. Writers build new dicts under tag_write_lock and publish them with
+# a single assignment, so readers just take a reference to the current snapshot without locking.
 tag_data_store = {}
+# Pre-serialized JSON (bytes) of each tag_data_store entry, refreshed whenever the entry changes,
+# so that broadcasts only assemble the envelope instead of re-encoding every tag.
+tag_json_cache = {}
+tag_write_lock = threading.Lock()
+tag_store_dirty = False # Set when tag_data_store changed since the last broadcast
+# Latest merged input of each tracker, written by the UDP listener: { "tag_id": {"ip", "distances", "last_seen"} }
+tracker_inputs = {}
+# Trackers whose input changed since the last update_loop tick, solved together on that tick.
+pending_tag_ids = set()
+pending_lock = threading.Lock()
 screen_config = {}
+# Raw JSON (bytes, in cm) of the config file, served by GET /api/anchors without touching the disk.
+# Refreshed whenever the config is loaded or saved.
+config_json_cache = b'{}'
 calibration_data = {} # Temp storage for old calibration
 data_lock = threading.RLock()
 
@@ -101,21 +157,40 @@ CALIBRATION_TARGET_POINTS_UV = [
     [0.95, 0.5],   # Right-Mid
     [0.95, 0.05]   # Bottom-Right
 ]
-calibration_measurements = [] # Stores the results of the 10-point measurement process.
+# Stores the results of the 10-point measurement process, keyed by step index: { step_index: {"uv", "pos3d"} }
+calibration_measurements = {}
 
 # --- Configuration Management ---
 def save_config(config_dict):
     """Saves the entire configuration dictionary to the config file."""
+    global config_json_cache
     try:
         with data_lock:
             with open(CONFIG_FILE, 'w') as f:
                 json.dump(config_dict, f, indent=4)
+            config_json_cache = orjson.dumps(config_dict, option=orjson.OPT_SERIALIZE_NUMPY)
     except Exception as e:
         print(f"[ERROR] Could not save config to {CONFIG_FILE}: {e}")
 
+def invalidate_tracker_positions():
+    """Queues every known tracker for a new solve, since the positions depend on the anchor and screen config."""
+    with pending_lock:
+        pending_tag_ids.update(tracker_inputs)
+
+def set_anchor_geometry(anchors_cm):
+    """Builds the stacked anchor arrays (in meters) from the anchors section of the config (in cm)."""
+    global ANCHOR_IDS, ANCHOR_XYZ, ANCHOR_SQNORM, ANCHOR_ID_TO_IDX
+    anchor_ids = tuple(anchors_cm.keys())
+    anchor_xyz = np.array([[v['x'], v['y'], v['z']] for v in anchors_cm.values()], dtype=np.float64) / 100.0
+    with data_lock:
+        ANCHOR_IDS = anchor_ids
+        ANCHOR_XYZ = anchor_xyz.reshape(-1, 3)
+        ANCHOR_SQNORM = (ANCHOR_XYZ ** 2).sum(axis=1)
+        ANCHOR_ID_TO_IDX = {anchor_id: i for i, anchor_id in enumerate(anchor_ids)}
+
 def load_or_create_config():
     """Loads anchor and screen config from config.json or creates it."""
-    global anchor_positions, screen_config
+    global screen_config, config_json_cache
     if not os.path.exists(CONFIG_FILE):
         print(f"'{CONFIG_FILE}' not found. Creating with default values.")
         default_config = {
@@ -132,49 +207,151 @@ def load_or_create_config():
     
     with open(CONFIG_FILE, 'r') as f:
         config_data = json.load(f)
+        # Cache the raw config (in cm) before the screen part is converted to meters below
+        config_json_cache = orjson.dumps(config_data)
         # Load anchor positions and immediately convert them to meters for all calculations
-        anchor_positions = {k: np.array(list(v.values())) / 100.0 for k, v in config_data['anchors'].items()}
+        set_anchor_geometry(config_data['anchors'])
         
-        screen_config = config_data.get('screen')
-        if screen_config:
+        # The new screen config is fully built before being published, since update_loop
+        # keeps a reference to it and uses it without holding the lock.
+        screen = config_data.get('screen')
+        if screen:
             # Screen config is saved in cm, convert to meters on load
-            screen_config['origin'] = np.array(screen_config['origin']) / 100.0
-            screen_config['vec_x'] = np.array(screen_config['vec_x']) / 100.0
-            screen_config['vec_y'] = np.array(screen_config['vec_y']) / 100.0
+            screen['origin'] = np.array(screen['origin']) / 100.0
+            screen['vec_x'] = np.array(screen['vec_x']) / 100.0
+            screen['vec_y'] = np.array(screen['vec_y']) / 100.0
+            screen['pinv'] = compute_screen_pinv(screen['vec_x'], screen['vec_y'])
             print("Screen configuration loaded and converted to meters.")
         else:
             print("Screen is not calibrated yet.")
+        screen_config = screen
+    invalidate_tracker_positions()
 
 # --- 3D Calculation and Projection ---
-def solve_3d_position(distances, anchors_in_meters):
-    """Calculates the 3D position of a tag using multilateration. Assumes distances are in meters."""
-    valid_anchors = []
-    valid_distances = []
-    for anchor_id, dist_m in distances.items():
-        if dist_m is not None and anchor_id in anchors_in_meters:
-            valid_anchors.append(anchors_in_meters[anchor_id])
-            valid_distances.append(dist_m) # Distances are already in meters
-
-    if len(valid_anchors) < 4:
-        return None
+@njit(cache=True, fastmath=True)
+def _residual(p, anchors, dists):
+    """Range residuals |p - a_i| - d_i for a candidate position `p`. `anchors` is (n, 3), `dists` is (n,)."""
+    n = anchors.shape[0]
+    r = np.empty(n)
+    for i in range(n):
+        dx = p[0] - anchors[i, 0]
+        dy = p[1] - anchors[i, 1]
+        dz = p[2] - anchors[i, 2]
+        r[i] = np.sqrt(dx * dx + dy * dy + dz * dz) - dists[i]
+    return r
+
+@njit(cache=True, fastmath=True)
+def _jacobian(p, anchors, dists):
+    """Jacobian (n, 3) of `_residual`: the unit vectors from each anchor towards `p`."""
+    n = anchors.shape[0]
+    J = np.empty((n, 3))
+    for i in range(n):
+        dx = p[0] - anchors[i, 0]
+        dy = p[1] - anchors[i, 1]
+        dz = p[2] - anchors[i, 2]
+        norm = max(np.sqrt(dx * dx + dy * dy + dz * dz), 1e-9) # Avoid dividing by zero on an anchor
+        J[i, 0] = dx / norm
+        J[i, 1] = dy / norm
+        J[i, 2] = dz / norm
+    return J
+
+@njit(cache=True, fastmath=True)
+def trilateration_error_and_grad(p, anchors, dists):
+    """
+    Sum of squared range residuals for a candidate position `p`, and its analytic gradient
+    2 * sum((p - a_i) * (1 - d_i / |p - a_i|)). Returned together (`jac=True`) so that L-BFGS-B
+    neither estimates the gradient by finite differences nor recomputes the residuals for it.
+    """
+    r = _residual(p, anchors, dists)
+    J = _jacobian(p, anchors, dists)
+    grad = np.zeros(3)
+    for i in range(r.shape[0]):
+        for k in range(3):
+            grad[k] += 2.0 * J[i, k] * r[i]
+    return np.sum(r * r), grad
+
+@njit(cache=True)
+def solve_levenberg_marquardt(initial_guess, anchors, dists, max_iter=30, step_tol=1e-12):
+    """
+    Minimizes the sum of squared range residuals with a compiled Levenberg-Marquardt loop, kept inside
+    the search box of SOLVER_BOUND_M. Returns (position, converged).
+    """
+    p = initial_guess.copy()
+    r = _residual(p, anchors, dists)
+    cost = np.sum(r * r)
+    damping = 1e-3
+    for _ in range(max_iter):
+        J = _jacobian(p, anchors, dists)
+        # Damped normal equations: (J^T J + damping * I) * step = J^T r
+        JtJ = np.zeros((3, 3))
+        Jtr = np.zeros(3)
+        for i in range(r.shape[0]):
+            for k in range(3):
+                Jtr[k] += J[i, k] * r[i]
+                for l in range(3):
+                    JtJ[k, l] += J[i, k] * J[i, l]
+        for k in range(3):
+            JtJ[k, k] += damping
+        step = np.linalg.solve(JtJ, Jtr)
+
+        p_new = np.minimum(np.maximum(p - step, -SOLVER_BOUND_M), SOLVER_BOUND_M)
+        r_new = _residual(p_new, anchors, dists)
+        cost_new = np.sum(r_new * r_new)
+        if cost_new <= cost:
+            moved = np.sum((p_new - p) ** 2)
+            p, r, cost = p_new, r_new, cost_new
+            damping *= 0.3
+            if moved < step_tol:
+                return p, True
+        else:
+            damping *= 10.0
+            if damping > 1e8:
+                break
+    return p, False
 
-    def error_func(p, anchors, dists):
-        err = []
-        for anchor, dist in zip(anchors, dists):
-            err.append((np.linalg.norm(p - anchor) - dist) ** 2)
-        return np.sum(err)
+def warm_up_solver():
+    """Compiles the numba solver functions ahead of time so the first packet does not pay for it."""
+    anchors = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+    dists = np.ones(4)
+    initial_guess = np.mean(anchors, axis=0)
+    solve_levenberg_marquardt(initial_guess, anchors, dists)
+    trilateration_error_and_grad(initial_guess, anchors, dists)
 
-    initial_guess = np.mean(valid_anchors, axis=0)
-    
-    # Define a reasonable search area (e.g., a 20x20x20 meter box around the origin)
-    bounds = [(-10, 10), (-10, 10), (-10, 10)] 
+def solve_3d_position(anchor_xyz, anchor_sqnorm, dists):
+    """
+    Calculates the 3D position of a tag using multilateration.
+    `anchor_xyz` (n, 3), `anchor_sqnorm` (n,) and `dists` (n,) only hold the anchors with a
+    valid distance. Assumes everything is in meters.
+    """
+    if len(dists) < 4:
+        return None
+
+    # Closed-form solution: subtracting the first sphere equation from the others gives
+    # a linear system A*p = b, with A_i = 2*(a_0 - a_i) and b_i = d_i² - d_0² + |a_0|² - |a_i|².
+    # It is solved through the 3x3 normal equations, much cheaper than the iterative solver.
+    A = 2.0 * (anchor_xyz[0] - anchor_xyz[1:])
+    b = dists[1:] ** 2 - dists[0] ** 2 + anchor_sqnorm[0] - anchor_sqnorm[1:]
+    AtA = A.T @ A
+    if np.linalg.cond(AtA) < LINEAR_SOLVER_MAX_COND:
+        return np.linalg.solve(AtA, A.T @ b) # Position in meters
+
+    # Poorly conditioned geometry (e.g. coplanar anchors): fall back to the nonlinear solver,
+    # the compiled Levenberg-Marquardt first, then L-BFGS-B if it did not converge.
+    initial_guess = np.mean(anchor_xyz, axis=0)
+    pos_3d, converged = solve_levenberg_marquardt(initial_guess, anchor_xyz, dists)
+    if converged:
+        return pos_3d # Position in meters
+
+    bounds = [(-SOLVER_BOUND_M, SOLVER_BOUND_M)] * 3
     
     result = minimize(
-        error_func, 
+        trilateration_error_and_grad, 
         initial_guess, 
-        args=(valid_anchors, valid_distances), 
+        args=(anchor_xyz, dists), 
         method='L-BFGS-B',
-        bounds=bounds
+        jac=True,
+        bounds=bounds,
+        options={'maxiter': 50, 'ftol': 1e-6} # Bounds the worst-case latency of a solve
     )
 
     if result.success:
@@ -183,155 +360,298 @@ def solve_3d_position(distances, anchors_in_meters):
     print(f"[Solver] 3D position solve failed. Message: {result.message}")
     return None
 
+def solve_3d_positions(anchor_xyz, anchor_sqnorm, dists):
+    """
+    Batched version of `solve_3d_position` for several tags at once.
+    `dists` is (T, N) with NaN for unknown distances; returns a (T, 3) array with NaN rows
+    where no position could be found. Everything is in meters.
+    """
+    positions = np.full((dists.shape[0], 3), np.nan)
+    known = ~np.isnan(dists)
+    complete = known.all(axis=1)
+
+    # Tags that have every distance share the same linear system matrix A (see solve_3d_position),
+    # so all of them are solved at once with the right-hand sides stacked as columns.
+    if complete.any() and len(anchor_sqnorm) >= 4:
+        A = 2.0 * (anchor_xyz[0] - anchor_xyz[1:])
+        AtA = A.T @ A
+        if np.linalg.cond(AtA) < LINEAR_SOLVER_MAX_COND:
+            D = dists[complete]
+            B = D[:, 1:] ** 2 - D[:, :1] ** 2 + anchor_sqnorm[0] - anchor_sqnorm[1:] # (Tc, N-1)
+            positions[complete] = np.linalg.solve(AtA, A.T @ B.T).T
+        else:
+            complete[:] = False
+
+    # The remaining tags (missing anchors or ill-conditioned geometry) are solved one by one
+    for t in np.flatnonzero(~complete):
+        mask = known[t]
+        pos_3d = solve_3d_position(anchor_xyz[mask], anchor_sqnorm[mask], dists[t, mask])
+        if pos_3d is not None:
+            positions[t] = pos_3d
+    return positions
+
+def compute_screen_pinv(vec_x, vec_y):
+    """
+    Returns the (2, 3) pseudo-inverse of the screen basis [vec_x, vec_y], or None if the
+    vectors are nearly collinear. It only changes with the screen config, so it is computed
+    once at load time instead of for every packet.
+    """
+    # vec_p = u * vec_x + v * vec_y, solved for [u, v] in the least-squares sense:
+    # [u, v] = (M^T M)^-1 M^T vec_p with M = [vec_x, vec_y]
+    M = np.stack([vec_x, vec_y], axis=1)
+    gram = M.T @ M
+    if abs(np.linalg.det(gram)) < 1e-9: # Vectors are nearly collinear, cannot solve
+        return None
+    return np.linalg.inv(gram) @ M.T
+
 def project_to_2d(pos_3d_m, config_in_meters):
-    """Projects a 3D position (in meters) onto the calibrated screen plane."""
-    if not config_in_meters or 'origin' not in config_in_meters:
+    """
+    Projects a 3D position (in meters) onto the calibrated screen plane.
+    Also accepts a (T, 3) array of positions, in which case a (T, 2) array is returned.
+    """
+    if not config_in_meters or config_in_meters.get('pinv') is None:
         return None
-    
-    pos_3d = np.array(pos_3d_m)
-    origin = config_in_meters['origin']
-    vec_x = config_in_meters['vec_x']
-    vec_y = config_in_meters['vec_y']
-
-    # Solve the 2D system of linear equations to find u and v
-    # vec_p = u * vec_x + v * vec_y
-    # We solve for [u, v] using dot products
-    vec_p = pos_3d - origin
-    
-    m_11 = np.dot(vec_x, vec_x)
-    m_12 = np.dot(vec_x, vec_y)
-    m_21 = m_12
-    m_22 = np.dot(vec_y, vec_y)
-    
-    det = m_11 * m_22 - m_12 * m_21
-    if abs(det) < 1e-9: # Vectors are nearly collinear, cannot solve
+    return (np.asarray(pos_3d_m) - config_in_meters['origin']) @ config_in_meters['pinv'].T
+
+# --- Background Task: UDP Listener ---
+def parse_tracker_datagram(data):
+    """
+    Decodes a tracker datagram (binary or JSON format) into (tag_id, [(anchor_id, distance_m), ...]).
+    Returns None if it is malformed.
+    """
+    if len(data) == BINARY_PACKET.size:
+        # Fast path: fixed binary layout, no JSON parsing
+        tag_num, *distances = BINARY_PACKET.unpack(data)
+        # Negative, NaN or infinite distances mean the anchor is out of range: they are passed on as
+        # "no reading" (queue_tracker_message stores non-finite values as None) to clear the previous one
+        return f"T{tag_num}", [(anchor_id, d if d >= 0 else None) for anchor_id, d in zip(BINARY_PACKET_ANCHOR_IDS, distances)]
+
+    try:
+        message = orjson.loads(data) # orjson parses the raw bytes directly
+        if not (isinstance(message, dict) and message.get("tag") and "anchors" in message):
+            return None
+        # The tag becomes a dict key of the broadcast payload, which orjson only accepts as a string
+        return str(message["tag"]), [(anchor.get('id'), anchor['distance']) for anchor in message["anchors"]]
+    except (orjson.JSONDecodeError, KeyError, AttributeError, TypeError):
         return None
 
-    inv_det = 1.0 / det
-    
-    d_1 = np.dot(vec_p, vec_x)
-    d_2 = np.dot(vec_p, vec_y)
-    
-    u = inv_det * (m_22 * d_1 - m_12 * d_2)
-    v = inv_det * (m_11 * d_2 - m_21 * d_1)
-    
-    return [u, v]
+def queue_tracker_message(tag_id, anchor_distances, addr):
+    """
+    Merges the distances of a tracker into tracker_inputs and, if they changed, marks the tracker
+    as pending: its position is solved by update_loop on its next tick. Must be called with pending_lock held.
+    """
+    inputs = tracker_inputs.get(tag_id)
+    if inputs is None:
+        print(f"[+] New tracker detected: {tag_id} from {addr[0]}.")
+        inputs = tracker_inputs[tag_id] = {
+            "ip": addr[0],
+            "distances": {anchor_id: None for anchor_id in ANCHOR_IDS},
+            "last_seen": time.time()
+        }
+        pending_tag_ids.add(tag_id)
+    current_distances = inputs['distances']
+    for anchor_id, distance in anchor_distances:
+        if anchor_id in ANCHOR_ID_TO_IDX:
+            # Converted here so that a malformed value cannot break the batched solve:
+            # a null, non-numeric or non-finite distance means "no reading" for this anchor.
+            try:
+                distance = float(distance)
+            except (TypeError, ValueError):
+                distance = None
+            if distance is not None and not math.isfinite(distance):
+                distance = None
+            if current_distances.get(anchor_id) != distance:
+                current_distances[anchor_id] = distance
+                pending_tag_ids.add(tag_id)
+    # If the distances did not change, the tracker is not queued: its solved position is still valid.
+    # last_seen is refreshed in any case, cleanup_loop relies on it.
+    inputs['last_seen'] = time.time()
 
-# --- Background Task: UDP Listener ---
 def udp_listener():
-    """Listens for incoming tracker data and processes it."""
+    """Listens for incoming tracker data and queues it for update_loop."""
     listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF_BYTES)
     listen_socket.bind(('0.0.0.0', UDP_PORT))
+    listen_socket.setblocking(False)
     print(f"[*] Passive UDP Listener started on port {UDP_PORT}")
 
     while True:
         try:
-            data, addr = listen_socket.recvfrom(1024)
-            message = json.loads(data.decode('utf-8'))
-            tag_id = message.get("tag")
-
-            if not (tag_id and "anchors" in message):
+            # Wait for data directly on the eventlet hub (epoll), then drain all the queued
+            # datagrams before touching the shared state
+            trampoline(listen_socket, read=True)
+            messages = []
+            for _ in range(UDP_MAX_BATCH):
+                try:
+                    data, addr = listen_socket.recvfrom(2048)
+                except BlockingIOError:
+                    break # Socket drained
+                message = parse_tracker_datagram(data)
+                # Silently ignore malformed packets
+                if message is not None:
+                    messages.append((*message, addr))
+
+            if not messages:
                 continue
 
-            with data_lock:
-                if tag_id not in tag_data_store:
-                    print(f"[+] New tracker detected: {tag_id} from {addr[0]}.")
-                    tag_data_store[tag_id] = {
-                        "ip": addr[0],
-                        "distances": {"A0": None, "A1": None, "A2": None, "A3": None},
-                        "position_3d": None,
-                        "position_2d": None,
-                        "status": "receiving"
-                    }
-
-                # Update distances and last_seen
-                tag_data_store[tag_id]['last_seen'] = time.time()
-                current_distances = tag_data_store[tag_id]['distances']
-                for anchor in message["anchors"]:
-                    if 'id' in anchor and anchor['id'] in current_distances:
-                        current_distances[anchor['id']] = anchor['distance']
-
-                # Calculate 3D position
-                pos_3d = solve_3d_position(current_distances, anchor_positions)
-                tag_data_store[tag_id]['position_3d'] = pos_3d.tolist() if pos_3d is not None else None
-                
-                # Update status based on solver result
-                if pos_3d is None:
-                    tag_data_store[tag_id]['status'] = "solver_failed"
-                else:
-                    tag_data_store[tag_id]['status'] = "tracking"
-
-                # Project to 2D if possible
-                if pos_3d is not None and screen_config:
-                    pos_2d = project_to_2d(pos_3d, screen_config)
-                    # Convert numpy floats to native python floats for JSON compatibility
-                    tag_data_store[tag_id]['position_2d'] = [float(p) for p in pos_2d] if pos_2d is not None else None
-                else:
-                    tag_data_store[tag_id]['position_2d'] = None
-                    if pos_3d is not None and not screen_config:
-                        tag_data_store[tag_id]['status'] = "needs_calibration"
-
-                # Emit update
-                socketio.emit('uwb_update', {
-                    "server_timestamp": time.time(),
-                    "tags": tag_data_store
-                })
-
-        except (json.JSONDecodeError, KeyError):
-            # Silently ignore malformed packets
-            pass
+            # A single lock acquisition for the whole batch
+            with pending_lock:
+                for tag_id, anchor_distances, addr in messages:
+                    try:
+                        queue_tracker_message(tag_id, anchor_distances, addr)
+                    except Exception as e:
+                        print(f"[!] Listener Error: {e}")
+
         except Exception as e:
             print(f"[!] Listener Error: {e}")
 
 # --- Background Task: Stale Tracker Cleanup ---
 def cleanup_loop():
-    """Periodically removes stale trackers from the data store."""
+    """
+    Periodically removes stale trackers from the data store. Staleness is based on the last packet
+    received (tracker_inputs), since the published entry is not refreshed while the distances are unchanged.
+    """
+    global tag_data_store, tag_json_cache, tag_store_dirty
     while True:
-        stale_tags_found = False
-        with data_lock:
-            # Create a copy of keys to allow safe modification during iteration
-            stale_check_keys = list(tag_data_store.keys())
-            for tag_id in stale_check_keys:
-                if (time.time() - tag_data_store[tag_id].get('last_seen', 0)) > TRACKER_TIMEOUT_S:
-                    print(f"[-] Tracker {tag_id} timed out. Removing.")
-                    del tag_data_store[tag_id]
-                    stale_tags_found = True
-        
-        # If a tracker was removed, notify the UI
-        if stale_tags_found:
-            with data_lock:
-                socketio.emit('uwb_update', {
-                    "server_timestamp": time.time(),
-                    "tags": tag_data_store
-                })
-        
+        try:
+            now = time.time()
+            with tag_write_lock:
+                with pending_lock:
+                    stale_tag_ids = [tag_id for tag_id, tag_input in tracker_inputs.items()
+                                     if now - tag_input['last_seen'] > TRACKER_TIMEOUT_S]
+                    for tag_id in stale_tag_ids:
+                        del tracker_inputs[tag_id]
+                        pending_tag_ids.discard(tag_id)
+                    live_tag_ids = set(tracker_inputs)
+
+                # Also drops any entry published by update_loop for a tracker removed in the meantime
+                if tag_data_store.keys() - live_tag_ids:
+                    tag_data_store = {tag_id: entry for tag_id, entry in tag_data_store.items() if tag_id in live_tag_ids}
+                    tag_json_cache = {tag_id: tag_json for tag_id, tag_json in tag_json_cache.items() if tag_id in live_tag_ids}
+                    # Notify the UI on the next broadcast tick
+                    tag_store_dirty = True
+
+            for tag_id in stale_tag_ids:
+                print(f"[-] Tracker {tag_id} timed out. Removing.")
+        except Exception as e:
+            print(f"[!] Cleanup Error: {e}")
+
         time.sleep(2) # Check for stale trackers every 2 seconds
 
+# --- Background Task: Batched Solver & Web Client Updates ---
+def build_update_payload():
+    """
+    Builds the `uwb_update` payload from the pre-serialized tag entries.
+    orjson.Fragment embeds the cached bytes as-is when OrjsonCodec encodes the packet.
+    No lock is needed: tag_json_cache is a copy-on-write snapshot.
+    """
+    json_cache = tag_json_cache
+    return {
+        "server_timestamp": time.time(),
+        "tags": {tag_id: orjson.Fragment(tag_json) for tag_id, tag_json in json_cache.items()}
+    }
+
+def solve_pending_tags():
+    """
+    Solves the positions of all the trackers updated since the last tick in one batched pass,
+    then publishes their new entries in tag_data_store.
+    """
+    global tag_data_store, tag_json_cache, tag_store_dirty
+    with pending_lock:
+        if not pending_tag_ids:
+            return
+        tag_ids = list(pending_tag_ids)
+        pending_tag_ids.clear()
+        # Copy the inputs, the UDP listener keeps merging new distances into them
+        inputs = [dict(tracker_inputs[tag_id], distances=dict(tracker_inputs[tag_id]['distances']))
+                  for tag_id in tag_ids]
+
+    with data_lock:
+        # Snapshot the anchor geometry and screen config so that the math runs without the lock
+        anchor_ids, anchor_xyz, anchor_sqnorm = ANCHOR_IDS, ANCHOR_XYZ, ANCHOR_SQNORM
+        screen = screen_config
+
+    # (T, N) distances with NaN for the unknown ones, solved and projected for all tags at once
+    dists = np.array([[tag_input['distances'].get(anchor_id) for anchor_id in anchor_ids]
+                      for tag_input in inputs], dtype=np.float64).reshape(len(inputs), len(anchor_ids))
+    positions_3d = solve_3d_positions(anchor_xyz, anchor_sqnorm, dists)
+    positions_2d = project_to_2d(positions_3d, screen) if screen else None
+
+    new_entries = {}
+    for t, (tag_id, tag_input) in enumerate(zip(tag_ids, inputs)):
+        # Update status based on solver result
+        pos_3d = None
+        pos_2d = None
+        if np.isnan(positions_3d[t, 0]):
+            status = "solver_failed"
+        else:
+            pos_3d = positions_3d[t].tolist()
+            if not screen:
+                status = "needs_calibration"
+            else:
+                status = "tracking"
+                if positions_2d is not None:
+                    pos_2d = positions_2d[t].tolist()
+        new_entries[tag_id] = {
+            "ip": tag_input['ip'],
+            "distances": tag_input['distances'],
+            "position_3d": pos_3d,
+            "position_2d": pos_2d,
+            "status": status,
+            "last_seen": tag_input['last_seen']
+        }
+    new_entries_json = {tag_id: orjson.dumps(entry) for tag_id, entry in new_entries.items()}
+
+    # Publish the new snapshots, the lock only covers the copy-and-swap
+    with tag_write_lock:
+        tag_data_store = {**tag_data_store, **new_entries}
+        tag_json_cache = {**tag_json_cache, **new_entries_json}
+    tag_store_dirty = True
+
+def update_loop():
+    """
+    Runs at UPDATE_BROADCAST_HZ: solves the trackers updated since the last tick, then sends the
+    tag data to the web clients if it changed. This decouples both the solver and the broadcasts
+    from the UDP packet rate: the store is serialized once per tick.
+    """
+    global tag_store_dirty
+    while True:
+        try:
+            solve_pending_tags()
+        except Exception as e:
+            print(f"[!] Solver Error: {e}")
+        try:
+            if tag_store_dirty:
+                # Reset the flag before taking the snapshot, so that a concurrent update is never lost
+                tag_store_dirty = False
+                socketio.emit('uwb_update', build_update_payload())
+        except Exception as e:
+            print(f"[!] Broadcast Error: {e}")
+        socketio.sleep(1.0 / UPDATE_BROADCAST_HZ)
+
 
 # --- API Routes for Anchor and Screen Configuration ---
 @app.route('/api/anchors', methods=['GET'])
 def get_anchors():
-    # This route is for display/edit in cm, so we read the raw file
-    with open(CONFIG_FILE, 'r') as f:
-        config_data = json.load(f)
-    return jsonify(config_data)
+    # This route is for display/edit in cm, so we serve the raw config as cached
+    # by load_or_create_config / save_config instead of re-reading the file.
+    with data_lock:
+        config_json = config_json_cache
+    return Response(config_json, mimetype='application/json')
 
 @app.route('/api/anchors', methods=['POST'])
 def set_anchors():
-    global anchor_positions
     new_config_data = request.get_json()
     if 'anchors' not in new_config_data:
         return jsonify({"status": "error", "message": "Invalid data"}), 400
 
-    with data_lock:
-        anchor_positions = {k: np.array(list(v.values())) for k, v in new_config_data['anchors'].items()}
+    set_anchor_geometry(new_config_data['anchors'])
+    invalidate_tracker_positions()
 
-    with open(CONFIG_FILE, 'r+') as f:
+    with open(CONFIG_FILE, 'r') as f:
         config = json.load(f)
-        config['anchors'] = new_config_data['anchors']
-        f.seek(0)
-        json.dump(config, f, indent=2)
-        f.truncate()
+    config['anchors'] = new_config_data['anchors']
+    save_config(config) # Also refreshes the cached config served by GET /api/anchors
     
     print("[Config] Anchor positions updated via API.")
     return jsonify({"status": "ok"})
@@ -401,53 +721,43 @@ def calib_record():
     tracker_id = request.json['tracker_id']
     step_index = request.json['step_index']
 
-    if step_index >= len(CALIBRATION_TARGET_POINTS_UV):
+    if not 0 <= step_index < len(CALIBRATION_TARGET_POINTS_UV):
         return jsonify({"status": "error", "message": "Index d'étape invalide."}), 400
 
-    with data_lock:
-        if tracker_id not in tag_data_store:
-            return jsonify({"status": "error", "message": f"Tracker {tracker_id} non trouvé."}), 404
+    if tracker_id not in tag_data_store:
+        return jsonify({"status": "error", "message": f"Tracker {tracker_id} non trouvé."}), 404
     
     print(f"[*] Starting 5-second measurement for step {step_index}...")
     
-    # Collect data for 5 seconds
-    collected_positions = []
-    start_time = time.time()
-    while time.time() - start_time < 5.0:
-        with data_lock:
-            # Check if tracker is still available
-            if tracker_id not in tag_data_store or tag_data_store[tracker_id].get('position_3d') is None:
-                socketio.sleep(0.1) # Wait a bit before retrying
-                continue
-            
-            # Record the current 3D position
-            pos_3d = tag_data_store[tracker_id]['position_3d']
-            collected_positions.append(pos_3d)
+    # Collect data for 5 seconds, accumulating a running sum instead of storing every sample
+    pos_sum = np.zeros(3)
+    num_samples = 0
+    deadline = time.time() + 5.0
+    while time.time() < deadline:
+        # Read the current 3D position from the tag store snapshot (no lock needed)
+        pos_3d = tag_data_store.get(tracker_id, {}).get('position_3d')
+        if pos_3d is None:
+            # Tracker not available yet, wait a bit before retrying
+            socketio.sleep(0.1)
+            continue
+        pos_sum += pos_3d
+        num_samples += 1
         socketio.sleep(0.05) # Sample at ~20Hz
 
-    if not collected_positions:
+    if num_samples == 0:
         return jsonify({"status": "error", "message": "Aucune donnée de position 3D reçue pendant 5s. Rapprochez le tracker."}), 500
 
     # Average the collected positions
-    avg_pos_3d = np.mean(np.array(collected_positions), axis=0)
+    avg_pos_3d = pos_sum / num_samples
     print(f"[+] Measurement complete. Average position: {avg_pos_3d.tolist()}")
 
     with data_lock:
-        # Store the known screen UV coordinate and the calculated 3D position
-        measurement = {
+        # Store the known screen UV coordinate and the calculated 3D position.
+        # Recording the same step again replaces its previous measurement.
+        calibration_measurements[step_index] = {
             "uv": CALIBRATION_TARGET_POINTS_UV[step_index],
             "pos3d": avg_pos_3d.tolist()
         }
-        
-        # Avoid duplicate points for the same step by replacing if it exists
-        found_and_replaced = False
-        for i, m in enumerate(calibration_measurements):
-            if m['uv'] == measurement['uv']:
-                calibration_measurements[i] = measurement
-                found_and_replaced = True
-                break
-        if not found_and_replaced:
-            calibration_measurements.append(measurement)
 
         print(f"[+] Calibration point {len(calibration_measurements)}/{len(CALIBRATION_TARGET_POINTS_UV)} recorded for step {step_index}.")
         return jsonify({"status": "ok", "points_recorded": len(calibration_measurements)})
@@ -474,45 +784,28 @@ def calib_calculate():
         # Px = Ox + u*Xx + v*Yx
         # Py = Oy + u*Xy + v*Yy
         # Pz = Oz + u*Xz + v*Yz
-        # This can be formed into a matrix equation A*s = p
-        
-        num_points = len(calibration_measurements)
-        # Create the large A matrix (3*num_points rows, 9 columns)
-        A = np.zeros((num_points * 3, 9))
-        # Create the b vector
-        b = np.zeros(num_points * 3)
-
-        for i, measurement in enumerate(calibration_measurements):
-            u, v = measurement['uv']
-            px, py, pz = measurement['pos3d']
-
-            # Row for Px
-            A[i*3, 0] = 1; A[i*3, 3] = u; A[i*3, 6] = v
-            b[i*3] = px
-            
-            # Row for Py
-            A[i*3+1, 1] = 1; A[i*3+1, 4] = u; A[i*3+1, 7] = v
-            b[i*3+1] = py
-
-            # Row for Pz
-            A[i*3+2, 2] = 1; A[i*3+2, 5] = u; A[i*3+2, 8] = v
-            b[i*3+2] = pz
+        # The three coordinates are independent and share the same design matrix [1, u, v],
+        # so this is a single least-squares problem A*S = P with three right-hand sides:
+        # A is (num_points, 3), P is (num_points, 3) and the rows of S are O, X and Y.
+        UV = np.asarray([m['uv'] for m in calibration_measurements.values()], dtype=np.float64)
+        P = np.asarray([m['pos3d'] for m in calibration_measurements.values()], dtype=np.float64)
+        A = np.hstack([np.ones((len(UV), 1)), UV])
 
         try:
-            solution, residuals, rank, s = np.linalg.lstsq(A, b, rcond=None)
+            solution, residuals, rank, s = np.linalg.lstsq(A, P, rcond=None)
             
             # Extract the 3D vectors from the solution
-            origin = solution[0:3]  # O_x, O_y, O_z
-            vec_x = solution[3:6]   # X_x, X_y, X_z
-            vec_y = solution[6:9]   # Y_x, Y_y, Y_z
+            origin = solution[0]  # O_x, O_y, O_z
+            vec_x = solution[1]   # X_x, X_y, X_z
+            vec_y = solution[2]   # Y_x, Y_y, Y_z
 
             # The calculated vectors vec_x and vec_y might not be perfectly orthogonal.
             # We will NOT force them to be, to account for non-rectangular screens.
             
             # Width and height are the magnitudes (lengths) of these basis vectors.
             # Convert from meters to cm for saving and display.
-            width_cm = np.linalg.norm(vec_x) * 100
-            height_cm = np.linalg.norm(vec_y) * 100 # Use the raw vector length
+            width_cm = float(np.linalg.norm(vec_x) * 100)
+            height_cm = float(np.linalg.norm(vec_y) * 100) # Use the raw vector length
 
             print(f"[+] Calibration Result: Origin={origin*100}cm, W={width_cm}cm, H={height_cm}cm")
 
@@ -593,11 +886,7 @@ def handle_connect():
     """Handles new web client connections."""
     print(f"[SocketIO] Web client connected.")
     # On connection, send the latest data immediately
-    with data_lock:
-        socketio.emit('uwb_update', {
-            "server_timestamp": time.time(),
-            "tags": tag_data_store
-        })
+    socketio.emit('uwb_update', build_update_payload())
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -608,9 +897,11 @@ def handle_disconnect():
 if __name__ == '__main__':
     print("[*] Starting UWB Passive Listener Server...")
     load_or_create_config() # Load config on startup
+    warm_up_solver() # JIT-compile the solver before the first packet arrives
     # Start background tasks
     socketio.start_background_task(target=udp_listener)
     socketio.start_background_task(target=cleanup_loop)
+    socketio.start_background_task(target=update_loop)
     
     print("[*] Server is running. Open the web interface.")
     socketio.run(app, host='0.0.0.0', port=5001, debug=False) 
\ No newline at end of file